@@ -0,0 +1,131 @@
+"""
+Recording of the traffic received by the registrar for later offline replay
+(see :py:mod:`qth_registrar.replay`).
+
+Recordings are append-only files containing one compact JSON array per line::
+
+    [timestamp, kind, topic, payload]
+
+Where timestamp is a Unix timestamp, kind is either :py:data:`CLIENT` (a
+message received on 'meta/clients/+') or :py:data:`LISTING` (a retained
+directory listing read back from 'meta/ls/#' on startup). Deleted
+(:py:data:`qth.Empty`) payloads are recorded by omitting the payload.
+
+Since several registrar runs may append to the same file, each run starts
+with a :py:data:`SESSION` record (which has no topic or payload)::
+
+    [timestamp, "session"]
+"""
+
+import json
+import time
+
+import qth
+
+CLIENT = "client"
+"""Record kind for client registration messages."""
+
+LISTING = "ls"
+"""Record kind for retained directory listings read back on startup."""
+
+SESSION = "session"
+"""Record kind marking the start of a recording session (registrar run)."""
+
+
+def _now(timestamp=None):
+    """Internal. Return the (rounded) timestamp to record, defaulting to
+    now."""
+    if timestamp is None:
+        timestamp = time.time()
+    return round(timestamp, 6)
+
+
+class Recorder(object):
+    """Appends received registrar traffic to a recording file."""
+
+    def __init__(self, filename, timestamp=None):
+        """Constructor. Starts a new session in the recording.
+
+        Params
+        ------
+        filename : str
+            The file to append the recording to. Created if it does not
+            exist.
+        timestamp : float or None
+            The Unix timestamp to record for the start of the session.
+            Defaults to now.
+        """
+        self._file = open(filename, "a")
+        self._write([_now(timestamp), SESSION])
+
+    def record(self, kind, topic, payload, timestamp=None):
+        """Append a single received message to the recording.
+
+        Params
+        ------
+        kind : str
+            :py:data:`CLIENT` or :py:data:`LISTING`.
+        topic : str
+            The topic the message was received on.
+        payload
+            The (deserialised) payload or :py:data:`qth.Empty`.
+        timestamp : float or None
+            The Unix timestamp to record. Defaults to now.
+        """
+        record = [_now(timestamp), kind, topic]
+        if payload is not qth.Empty:
+            record.append(payload)
+        self._write(record)
+
+    def _write(self, record):
+        """Internal. Append a single record to the file."""
+        self._file.write(json.dumps(record, separators=(",", ":")))
+        self._file.write("\n")
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+def iter_recording(filename):
+    """Iterate over the (timestamp, kind, topic, payload) tuples in a
+    recording file. Deleted payloads are given as :py:data:`qth.Empty`.
+    :py:data:`SESSION` records are given with a topic of None and an Empty
+    payload.
+    """
+    with open(filename, "r") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            timestamp, kind, *topic_and_payload = json.loads(line)
+            if kind == SESSION:
+                yield (timestamp, kind, None, qth.Empty)
+            else:
+                topic, *payload = topic_and_payload
+                yield (timestamp, kind, topic,
+                       payload[0] if payload else qth.Empty)
+
+
+def read_sessions(filename):
+    """Read a recording file, split into sessions.
+
+    Returns
+    -------
+    sessions : [(start_timestamp, [(timestamp, kind, topic, payload), ...]),
+                ...]
+        For each session, in order, the time the session started and its
+        :py:data:`CLIENT` and :py:data:`LISTING` records (see
+        :py:func:`iter_recording`). Any records before the first
+        :py:data:`SESSION` record are treated as a session starting at the
+        first record.
+    """
+    sessions = []
+    for record in iter_recording(filename):
+        timestamp, kind, _topic, _payload = record
+        if kind == SESSION:
+            sessions.append((timestamp, []))
+        else:
+            if not sessions:
+                sessions.append((timestamp, []))
+            sessions[-1][1].append(record)
+    return sessions
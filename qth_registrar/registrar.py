@@ -2,17 +2,36 @@ from collections import defaultdict
 
 import asyncio
 import logging
+import time
+import zlib
 
 import qth
 
-from qth_registrar.tree import client_registrations_to_directory_tree
+from qth_registrar.tree import \
+    client_registrations_to_directory_tree_steps, listing_digest
+from qth_registrar.recording import Recorder, CLIENT, LISTING
+from qth_registrar.tracing import Tracer
+
+
+class _PublisherClient(qth.Client):
+    """A :py:class:`qth.Client` for the registrar's pool of publishing
+    connections. These never publish a Qth client registration so that they
+    do not appear in the directory listing.
+    """
+
+    async def publish_registration(self, force=False):
+        pass
 
 
 class QthRegistrar(object):
     """A registration server for Qth."""
 
     def __init__(self, load_time=3.0, host=None, port=None,
-                 keepalive=10):
+                 keepalive=10, record_filename=None, client=None,
+                 digest_tree=False, directory_summaries=False,
+                 reconcile_slice=0.005, stall_check_interval=0.1,
+                 num_publishers=0, publishers=None,
+                 trace_filename=None, trace_log=False):
         """Constructor
 
         Params
@@ -20,13 +39,89 @@ class QthRegistrar(object):
         load_time : float
             The time to allow the MQTT server to send all retained messages in
             response to a subscription.
+        record_filename : str or None
+            If given, append all received client registrations and read-back
+            directory listings to this file (see
+            :py:mod:`qth_registrar.recording`).
+        client : :py:class:`qth.Client` or None
+            If given, use this client rather than connecting to the MQTT
+            server given by host, port and keepalive. (Used by
+            :py:mod:`qth_registrar.replay`.)
+        digest_tree : bool
+            If True, retain only a compact digest of each published listing
+            (rather than a complete copy) to diff against, reducing memory
+            usage.
+        directory_summaries : bool
+            If True, subdirectory entries in listings include a summary of the
+            subdirectory's contents (see
+            :py:meth:`qth_registrar.tree.Tree.get_summary`).
+        reconcile_slice : float or None
+            The maximum time (seconds) the tree build and diff may run for
+            before yielding to the event loop. If None, reconciliation runs
+            without yielding.
+        stall_check_interval : float
+            The interval (seconds) at which event loop stalls are measured
+            (see :py:attr:`max_loop_stall`).
+        num_publishers : int
+            The number of additional MQTT connections (to the same host, port
+            and keepalive) to open for publishing directory listings. Listings
+            are spread across these and the main connection, always using the
+            same connection for a given listing to preserve ordering.
+            Ignored if client or publishers is given.
+        publishers : [:py:class:`qth.Client`, ...] or None
+            If given, use these clients as the additional publishing
+            connections rather than creating num_publishers new ones. These
+            clients are left out of the directory listing.
+        trace_filename : str or None
+            If given, append a registration-to-listing latency trace record
+            for every received client registration to this file (see
+            :py:mod:`qth_registrar.tracing`).
+        trace_log : bool
+            If True, log every latency trace record.
         """
         self._load_time = load_time
         self._loop = asyncio.get_event_loop()
-        self._client = qth.Client("qth_registrar",
-                                  "Implements the Qth Registration service.",
-                                  host=host, port=port,
-                                  keepalive=keepalive)
+
+        # Additional connections used to publish directory listings
+        if publishers is None:
+            publishers = []
+            if client is None:
+                publishers = [
+                    _PublisherClient("qth_registrar_publisher",
+                                     host=host, port=port,
+                                     keepalive=keepalive)
+                    for _ in range(num_publishers)
+                ]
+        self._publishers = publishers
+
+        # The client IDs of the publishing connections. Though these never
+        # register themselves, their wills and disconnection still produce
+        # (empty) registration messages which are ignored.
+        self._publisher_client_ids = set(
+            publisher.client_id for publisher in self._publishers)
+
+        if client is None:
+            client = qth.Client("qth_registrar",
+                                "Implements the Qth Registration service.",
+                                host=host, port=port,
+                                keepalive=keepalive)
+        self._client = client
+
+        # If recording, the Recorder to log received messages to
+        self._recorder = (Recorder(record_filename)
+                          if record_filename is not None else None)
+
+        # If tracing, the Tracer to output trace records to
+        self._tracer = (Tracer(trace_filename, trace_log)
+                        if trace_filename is not None or trace_log else None)
+
+        # When tracing, the (client_id, wall time, monotonic time) of every
+        # registration received but not yet covered by a reconciliation.
+        self._trace_events = []
+
+        # The number of reconciliations started (used to identify them in
+        # trace records).
+        self._num_reconciles = 0
 
         # When the server first starts up we allow some time to receive the
         # complete set of retained messages indicating client states and the
@@ -42,22 +137,48 @@ class QthRegistrar(object):
         # Mapping from client_id to the latest report from that client
         self._client_registrations = {}
 
-        # For every directory, the most recently published listing.
+        # For every directory, the most recently published listing (or its
+        # digest if self._digest_tree is True, see _summarise_listing).
+        self._digest_tree = digest_tree
         self._cur_tree = {}
 
+        # Should directory entries include summaries
+        self._directory_summaries = directory_summaries
+
         # A lock which is held while the tree is reconciled.
         self._reconciliation_lock = asyncio.Lock()
 
+        # The time budget for each step of the reconciliation process before
+        # yielding to the event loop.
+        self._reconcile_slice = reconcile_slice
+
+        # The longest time the event loop has been observed to be blocked for
+        # (seconds), measured by _monitor_loop_stalls.
+        self.max_loop_stall = 0.0
+        self._stall_check_interval = stall_check_interval
+        self._stall_monitor_task = None
+
         logging.info("Qth registrar starting...")
         self._loop.create_task(self._startup())
 
     async def close(self):
         logging.info("Qth registrar shutting down...")
         self._enable_listings_updates = False
+        if self._stall_monitor_task is not None:
+            self._stall_monitor_task.cancel()
+        for publisher in self._publishers:
+            await publisher.close()
         await self._client.close()
+        if self._recorder is not None:
+            self._recorder.close()
+        if self._tracer is not None:
+            self._tracer.close()
         logging.info("Qth registrar shut down.")
 
     async def _startup(self):
+        self._stall_monitor_task = self._loop.create_task(
+            self._monitor_loop_stalls())
+
         # Register just the root 'ls' endpoint as a hint for browsers. We can't
         # provide a full directory listing as this would produce an infinitely
         # recurring tree!
@@ -68,6 +189,8 @@ class QthRegistrar(object):
             "the lower levels of this hierarchy do not appear in the listing.")
 
         await self._client.ensure_connected()
+        for publisher in self._publishers:
+            await publisher.ensure_connected()
 
         # Fetch the current published tree and client registrations
         logging.info("Waiting for all client registrations to arrive.")
@@ -91,7 +214,9 @@ class QthRegistrar(object):
         self._cur_tree = {}
 
         def on_dir_listing_received(topic, payload):
-            self._cur_tree[topic] = payload
+            if self._recorder is not None:
+                self._recorder.record(LISTING, topic, payload)
+            self._cur_tree[topic] = self._summarise_listing(payload)
         await self._client.subscribe("meta/ls/#", on_dir_listing_received)
 
         # Give the tree time to be received
@@ -99,12 +224,89 @@ class QthRegistrar(object):
 
         await self._client.unsubscribe("meta/ls/#", on_dir_listing_received)
 
+    async def _monitor_loop_stalls(self):
+        """Internal. Runs forever, recording the longest time the event loop
+        was blocked for in self.max_loop_stall.
+        """
+        while True:
+            before = time.monotonic()
+            await asyncio.sleep(self._stall_check_interval)
+            stall = time.monotonic() - before - self._stall_check_interval
+            if stall > self.max_loop_stall:
+                self.max_loop_stall = stall
+                logging.debug("Worst event loop stall so far: %.1f ms",
+                              stall * 1000)
+
+    async def _run_sliced(self, steps):
+        """Internal. Run a generator which yields after each small unit of
+        work to completion, yielding to the event loop whenever the
+        reconcile_slice time budget is used up. Returns the value returned by
+        the generator.
+        """
+        slice_start = time.monotonic()
+        while True:
+            try:
+                next(steps)
+            except StopIteration as e:
+                return e.value
+            if (self._reconcile_slice is not None and
+                    time.monotonic() - slice_start >= self._reconcile_slice):
+                await asyncio.sleep(0)
+                slice_start = time.monotonic()
+
+    def _diff_steps(self, new_tree):
+        """Internal. A generator which diffs new_tree against
+        self._cur_tree, yielding after every topic (see _run_sliced). Returns
+        (new_summary, to_change) where new_summary is the value for
+        self._cur_tree once new_tree is published and to_change is the set of
+        topics which need re-publishing.
+        """
+        new_summary = {}
+        for topic, listing in new_tree.items():
+            new_summary[topic] = self._summarise_listing(listing)
+            yield
+
+        to_change = set()
+        for topic in set(new_summary) | set(self._cur_tree):
+            if new_summary.get(topic) != self._cur_tree.get(topic):
+                to_change.add(topic)
+            yield
+
+        return (new_summary, to_change)
+
+    def _publisher_for(self, topic):
+        """Internal. Get the client to publish a given directory listing
+        topic with. Always returns the same client for a given topic.
+        """
+        publishers = [self._client] + self._publishers
+        return publishers[zlib.crc32(topic.encode("utf-8")) % len(publishers)]
+
+    def _summarise_listing(self, listing):
+        """Internal. Return the value to store in self._cur_tree for a given
+        listing: either the listing itself or, if self._digest_tree is set, its
+        digest.
+        """
+        if self._digest_tree and listing is not qth.Empty:
+            return listing_digest(listing)
+        else:
+            return listing
+
     async def _on_client_changed(self, topic, payload):
         """Internal. Callback when a client changes its registration
         details.
         """
-        # Update the client record
+        # Ignore our own publishing connections
         client_id = topic.split("/")[-1]
+        if client_id in self._publisher_client_ids:
+            return
+
+        if self._recorder is not None:
+            self._recorder.record(CLIENT, topic, payload)
+
+        # Update the client record
+        if self._tracer is not None:
+            self._trace_events.append(
+                (client_id, time.time(), time.monotonic()))
         if payload is not qth.Empty:
             # Child connected or changed
             if client_id not in self._client_registrations:
@@ -141,15 +343,24 @@ class QthRegistrar(object):
         """
         async with self._reconciliation_lock:
             logging.info("Reconciling tree...")
+            self._num_reconciles += 1
+            reconcile_id = self._num_reconciles
+
+            # The registrations covered by this reconciliation (when tracing)
+            trace_events = self._trace_events
+            self._trace_events = []
+            start_time = time.monotonic()
+
             # Compute the complete desired directory tree
-            new_tree = client_registrations_to_directory_tree(
-                self._client_registrations)
+            new_tree = await self._run_sliced(
+                client_registrations_to_directory_tree_steps(
+                    self._client_registrations, self._directory_summaries))
+            build_time = time.monotonic()
 
             # Find the set of topics which need re-publishing
-            to_change = set()
-            for topic in set(new_tree) | set(self._cur_tree):
-                if new_tree.get(topic) != self._cur_tree.get(topic):
-                    to_change.add(topic)
+            new_summary, to_change = await self._run_sliced(
+                self._diff_steps(new_tree))
+            diff_time = time.monotonic()
 
             # Generate publications.
             message_tasks = []
@@ -158,7 +369,8 @@ class QthRegistrar(object):
                 retain = new_value is not None
                 message_tasks.append(
                     asyncio.create_task(
-                        self._client.publish(topic, new_value, retain=retain)))
+                        self._publisher_for(topic).publish(
+                            topic, new_value, retain=retain)))
 
             # Wait for publications to take effect
             if message_tasks:
@@ -168,15 +380,32 @@ class QthRegistrar(object):
                     done, pending = await asyncio.wait(
                         message_tasks)
                     assert len(pending) == 0
-                    self._cur_tree = new_tree
+                    self._cur_tree = new_summary
                 except Exception as e:
                     # If publication fails we'll be left in an unknown state;
                     # republish everything from scratch.
                     logging.error("Tree update failed, "
                                   "will recreate tree from scratch...")
                     self._cur_tree = {}
+                    # Trace these registrations against the retry instead
+                    self._trace_events.extend(trace_events)
+                    trace_events = []
                     if self._enable_listings_updates:
                         self._loop.create_task(self._reconcile())
                     logging.exception(e)
             else:
                 logging.info("No changes to tree required!")
+            publish_time = time.monotonic()
+
+            for client_id, received, received_time in trace_events:
+                self._tracer.trace({
+                    "client_id": client_id,
+                    "received": received,
+                    "reconcile": reconcile_id,
+                    "queued": start_time - received_time,
+                    "build": build_time - start_time,
+                    "diff": diff_time - build_time,
+                    "publish": publish_time - diff_time,
+                    "num_published": len(to_change),
+                    "latency": publish_time - received_time,
+                })
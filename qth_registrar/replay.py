@@ -0,0 +1,278 @@
+#!/usr/bin/env python
+
+"""
+Replay a recording (see :py:mod:`qth_registrar.recording`) into a
+:py:class:`QthRegistrar` connected to a stub client, reporting on the
+reconciliation behaviour of the registrar.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import time
+
+import qth
+
+from qth_registrar import QthRegistrar, __version__
+from qth_registrar.recording import read_sessions, CLIENT, LISTING
+
+
+class StubClient(object):
+    """A stand-in for :py:class:`qth.Client` which delivers recorded messages
+    to the registrar and logs (rather than sends) everything it publishes.
+    """
+
+    def __init__(self, listings, client_id="stub_client"):
+        """Constructor
+
+        Params
+        ------
+        listings : {topic: payload, ...}
+            The retained directory listings to deliver on subscription to
+            'meta/ls/#'.
+        client_id : str
+            The client ID reported by this client.
+        """
+        self._listings = listings
+        self.client_id = client_id
+
+        # Mapping from subscribed topic to callback
+        self._callbacks = {}
+
+        # The number of publications (of any kind) made and the total
+        # JSON-serialised size of their payloads (as sent by qth.Client).
+        self.num_publishes = 0
+        self.publish_bytes = 0
+
+    async def _call(self, callback, topic, payload):
+        result = callback(topic, payload)
+        if asyncio.iscoroutine(result):
+            await result
+
+    async def deliver(self, kind, topic, payload):
+        """Deliver a recorded message to the registrar, if subscribed."""
+        callback = self._callbacks.get(
+            "meta/clients/+" if kind == CLIENT else "meta/ls/#")
+        if callback is not None:
+            await self._call(callback, topic, payload)
+
+    async def ensure_connected(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def register(self, *args, **kwargs):
+        pass
+
+    async def subscribe(self, topic, callback):
+        self._callbacks[topic] = callback
+        if topic == "meta/ls/#":
+            for ls_topic, payload in self._listings.items():
+                await self._call(callback, ls_topic, payload)
+
+    async def unsubscribe(self, topic, callback):
+        self._callbacks.pop(topic, None)
+
+    async def publish(self, topic, payload, retain=False):
+        self.num_publishes += 1
+        if payload is not qth.Empty:
+            self.publish_bytes += len(json.dumps(payload))
+
+    async def send_event(self, topic, value=None):
+        await self.publish(topic, value)
+
+    async def set_property(self, topic, value):
+        await self.publish(topic, value, retain=True)
+
+    async def delete_property(self, topic):
+        await self.set_property(topic, qth.Empty)
+
+
+class _InstrumentedRegistrar(QthRegistrar):
+    """A :py:class:`QthRegistrar` which records the latency of every
+    reconciliation.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.reconcile_latencies = []
+        self.reconciles_in_progress = 0
+        super().__init__(*args, **kwargs)
+
+    def _reconcile(self):
+        # NB: Counted when the reconciliation is requested (rather than when
+        # it starts running) so that reconciliations which have been
+        # scheduled but not yet started are not missed.
+        self.reconciles_in_progress += 1
+        return self._instrumented_reconcile(time.monotonic())
+
+    async def _instrumented_reconcile(self, requested):
+        try:
+            await super()._reconcile()
+            self.reconcile_latencies.append(time.monotonic() - requested)
+        finally:
+            self.reconciles_in_progress -= 1
+
+
+async def replay(filename, speed=1.0, load_time=3.0, digest_tree=False,
+                 reconcile_slice=0.005, session=0):
+    """Replay a recording into a :py:class:`QthRegistrar`.
+
+    Params
+    ------
+    filename : str
+        The recording to replay.
+    speed : float
+        The playback speed relative to the original recording. Use
+        ``float("inf")`` to replay as fast as possible.
+    load_time : float
+        The (unscaled) load time to pass to the registrar.
+    digest_tree : bool
+    reconcile_slice : float or None
+        Passed to the registrar.
+    session : int
+        The index of the session (registrar run) within the recording to
+        replay. Negative indices count from the last session.
+
+    Returns
+    -------
+    report : dict
+        A dictionary with the following entries:
+
+        * "num_sessions": The number of sessions in the recording.
+        * "num_messages": The number of client messages replayed.
+        * "num_reconciles": The number of reconciliations performed.
+        * "reconcile_latencies": A list of the wall-clock time taken by each
+          reconciliation from being requested to completing (including the
+          time spent waiting for an earlier reconciliation to complete).
+        * "num_publishes": The number of messages published.
+        * "publish_bytes": The total JSON-serialised size of all published
+          payloads.
+        * "max_loop_stall": The longest event loop stall observed (seconds).
+    """
+    sessions = read_sessions(filename)
+    try:
+        start_timestamp, records = sessions[session]
+    except IndexError:
+        raise ValueError("Recording {} contains {} session(s), "
+                         "no session {}.".format(filename, len(sessions),
+                                                 session))
+
+    listings = {}
+    messages = []
+    for timestamp, kind, topic, payload in records:
+        if kind == LISTING:
+            listings[topic] = payload
+        else:
+            messages.append((timestamp, kind, topic, payload))
+
+    client = StubClient(listings)
+    reg = _InstrumentedRegistrar(load_time=load_time / speed, client=client,
+                                 digest_tree=digest_tree,
+                                 reconcile_slice=reconcile_slice)
+
+    # Wait for the registrar to subscribe to client registrations
+    while "meta/clients/+" not in client._callbacks:
+        await asyncio.sleep(0)
+
+    # Messages are replayed relative to the start of the session (i.e.
+    # when the recorded registrar started).
+    last_timestamp = start_timestamp
+    for timestamp, kind, topic, payload in messages:
+        delay = (timestamp - last_timestamp) / speed
+        last_timestamp = timestamp
+        await asyncio.sleep(delay)
+        await client.deliver(kind, topic, payload)
+
+    # Wait for the registrar to become idle: startup complete and no
+    # reconciliation requested or running. (Sleep first to give the registrar
+    # a chance to handle the last message.)
+    while True:
+        await asyncio.sleep(0.01)
+        if (reg._enable_listings_updates and
+                not reg.reconciles_in_progress):
+            break
+
+    await reg.close()
+
+    return {
+        "num_sessions": len(sessions),
+        "num_messages": len(messages),
+        "num_reconciles": len(reg.reconcile_latencies),
+        "reconcile_latencies": reg.reconcile_latencies,
+        "num_publishes": client.num_publishes,
+        "publish_bytes": client.publish_bytes,
+        "max_loop_stall": reg.max_loop_stall,
+    }
+
+
+def main(args=None):
+    """Command-line launcher for the replay tool.
+
+    Parameters
+    ----------
+    args : [arg, ...]
+        The command-line arguments passed to the program.
+    """
+    parser = argparse.ArgumentParser(
+        description="Replay a recording made with 'qth_registrar --record' "
+                    "into an offline Qth registration server.")
+    parser.add_argument("--version", "-V", action="version",
+                        version="%(prog)s {}".format(__version__))
+    parser.add_argument("recording",
+                        help="The recording file to replay.")
+    parser.add_argument("--speed",
+                        default=1.0, type=float,
+                        help="The playback speed multiplier ('inf' to replay "
+                             "as fast as possible).")
+    parser.add_argument("--load-time",
+                        default=3.0, type=float,
+                        help="The load time to use (scaled by --speed).")
+    parser.add_argument("--session",
+                        default=0, type=int, metavar="N",
+                        help="The session (registrar run) within the "
+                             "recording to replay, counting from 0 "
+                             "(default: the first).")
+    parser.add_argument("--digest-tree", action="store_true",
+                        help="Run the registrar with --digest-tree.")
+    parser.add_argument("--reconcile-slice",
+                        default=5.0, type=float, metavar="MS",
+                        help="Run the registrar with --reconcile-slice.")
+    parser.add_argument("--verbose", "-v", action="store_true",
+                        help="show registrar log output")
+    args = parser.parse_args(args)
+
+    if args.verbose:
+        logging.basicConfig(level=logging.INFO)
+
+    loop = asyncio.get_event_loop()
+    report = loop.run_until_complete(
+        replay(args.recording, args.speed, args.load_time,
+               args.digest_tree,
+               (args.reconcile_slice / 1000.0
+                if args.reconcile_slice else None),
+               args.session))
+
+    latencies = report["reconcile_latencies"]
+    if report["num_sessions"] > 1:
+        print("Replayed session {} of {} (use --session to choose).".format(
+            args.session, report["num_sessions"]))
+    print("Messages replayed: {}".format(report["num_messages"]))
+    print("Reconciles: {}".format(report["num_reconciles"]))
+    if latencies:
+        print("Reconcile latency (ms): min {:.3f}, mean {:.3f}, "
+              "max {:.3f}".format(min(latencies) * 1000,
+                                  sum(latencies) * 1000 / len(latencies),
+                                  max(latencies) * 1000))
+    print("Publishes: {} ({} bytes)".format(report["num_publishes"],
+                                            report["publish_bytes"]))
+    print("Worst event loop stall (ms): {:.3f}".format(
+        report["max_loop_stall"] * 1000))
+
+    return 0
+
+
+if __name__ == "__main__":  # pragma: no cover
+    import sys
+    sys.exit(main())
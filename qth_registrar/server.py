@@ -38,6 +38,34 @@ def main(args=None):
                         help="The number of seconds to wait for all existing "
                              "listings and client registrations to be "
                              "received after startup.")
+    parser.add_argument("--record",
+                        default=None, metavar="FILE",
+                        help="Append all received client registrations and "
+                             "directory listings to FILE for later replay "
+                             "with qth_registrar_replay.")
+    parser.add_argument("--digest-tree", action="store_true",
+                        help="Retain only a digest of each published "
+                             "directory listing, reducing memory usage.")
+    parser.add_argument("--directory-summaries", action="store_true",
+                        help="Include a summary of each subdirectory's "
+                             "contents (topic, behaviour and client counts) "
+                             "in directory listings.")
+    parser.add_argument("--reconcile-slice",
+                        default=5.0, type=float, metavar="MS",
+                        help="The maximum number of milliseconds "
+                             "reconciliation may block the event loop for "
+                             "at a time (0 to never yield).")
+    parser.add_argument("--publishers",
+                        default=0, type=int, metavar="N",
+                        help="The number of additional MQTT connections to "
+                             "use for publishing directory listings.")
+    parser.add_argument("--trace",
+                        default=None, metavar="FILE",
+                        help="Append a registration-to-listing latency trace "
+                             "record for every client registration to FILE.")
+    parser.add_argument("--trace-log", action="store_true",
+                        help="Log a registration-to-listing latency trace "
+                             "record for every client registration.")
     parser.add_argument("--quiet", "-q", action="store_true",
                         help="hide non-error output")
     args = parser.parse_args(args)
@@ -48,7 +76,15 @@ def main(args=None):
     loop = asyncio.get_event_loop()
     reg = QthRegistrar(host=args.host, port=args.port,
                        keepalive=args.keepalive,
-                       load_time=args.load_time)
+                       load_time=args.load_time,
+                       record_filename=args.record,
+                       digest_tree=args.digest_tree,
+                       directory_summaries=args.directory_summaries,
+                       reconcile_slice=(args.reconcile_slice / 1000.0
+                                        if args.reconcile_slice else None),
+                       num_publishers=args.publishers,
+                       trace_filename=args.trace,
+                       trace_log=args.trace_log)
     try:
         loop.run_forever()
     except KeyboardInterrupt:
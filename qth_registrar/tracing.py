@@ -0,0 +1,60 @@
+"""
+Tracing of the latency between client registrations being received by the
+registrar and the directory listings being updated to reflect them.
+
+One trace record is produced for each received registration message, once the
+reconciliation which covers it has completed. Each record is a dictionary with
+the following entries:
+
+* "client_id": The client whose registration was received.
+* "received": The Unix timestamp at which the registration was received.
+* "reconcile": A sequence number identifying the reconciliation which
+  covered the registration. (Several registrations may be covered by the same
+  reconciliation.)
+* "queued": The time (seconds) between the registration being received and
+  the reconciliation starting (including waiting for any earlier
+  reconciliation to complete).
+* "build": The time spent building the new directory tree.
+* "diff": The time spent diffing the new tree against the published tree.
+* "publish": The time spent publishing changed listings.
+* "num_published": The number of listings published.
+* "latency": The end-to-end time between the registration being received and
+  the listings being updated.
+
+Trace records may be written to an append-only file (one compact JSON object
+per line) and/or logged.
+"""
+
+import json
+import logging
+
+
+class Tracer(object):
+    """Writes registration latency trace records to a file and/or the log."""
+
+    def __init__(self, filename=None, log=False):
+        """Constructor
+
+        Params
+        ------
+        filename : str or None
+            If given, the file to append trace records to.
+        log : bool
+            If True, log every trace record.
+        """
+        self._file = open(filename, "a") if filename is not None else None
+        self._log = log
+
+    def trace(self, record):
+        """Output a single trace record (a JSON-serialisable dict)."""
+        line = json.dumps(record, separators=(",", ":"))
+        if self._log:
+            logging.info("Trace: %s", line)
+        if self._file is not None:
+            self._file.write(line)
+            self._file.write("\n")
+            self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
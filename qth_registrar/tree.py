@@ -3,9 +3,11 @@ Internal data-structures/algorithms to construct the directory tree structure
 published by the registrar.
 """
 
+import hashlib
+import json
 import logging
 
-from collections import defaultdict
+from collections import defaultdict, Counter
 
 import qth
 
@@ -13,9 +15,26 @@ import qth
 class Tree(object):
     """A recursive tree structure in a directory tree."""
 
-    def __init__(self):
+    def __init__(self, summaries=False):
+        """Constructor
+
+        Params
+        ------
+        summaries : bool
+            If True, maintain a summary of the contents of this tree (see
+            :py:meth:`get_summary`) and include summaries in subdirectory
+            entries in listings.
+        """
         self.children = defaultdict(list)
 
+        # Aggregate summaries of every topic in this tree (recursively). These
+        # are updated as topics are added to avoid re-crawling the tree.
+        self.summaries = summaries
+        if summaries:
+            self.num_topics = 0
+            self.behaviour_counts = Counter()
+            self.client_ids = set()
+
     def add_topic(self, topic, description):
         """Add a new path to the tree.
 
@@ -27,6 +46,13 @@ class Tree(object):
         description : dict
             The dictionary describing that topic.
         """
+        if self.summaries:
+            self.num_topics += 1
+            if description.get("behaviour") is not None:
+                self.behaviour_counts[description["behaviour"]] += 1
+            if description.get("client_id") is not None:
+                self.client_ids.add(description["client_id"])
+
         if "/" in topic:
             dirname, _, sub_topic = topic.partition("/")
 
@@ -36,27 +62,60 @@ class Tree(object):
                     tree = child
                     break
             if tree is None:
-                tree = Tree()
+                tree = Tree(self.summaries)
                 self.children[dirname].append(tree)
 
             tree.add_topic(sub_topic, description)
         else:
             self.children[topic].append(description)
 
+    def get_summary(self):
+        """Get a JSON-serialisable summary of the contents of this tree.
+        Only available if the tree was constructed with summaries=True.
+
+        Returns
+        -------
+        summary : dict
+            A dictionary with the following entries:
+
+            * "num_topics": The total number of topics registered in this
+              tree (recursively).
+            * "behaviours": A dictionary giving the number of topics with each
+              behaviour.
+            * "num_clients": The number of distinct clients with topics in
+              this tree.
+        """
+        return {
+            "num_topics": self.num_topics,
+            "behaviours": dict(self.behaviour_counts),
+            "num_clients": len(self.client_ids),
+        }
+
     def get_listing(self):
         """Get a JSON-serialisable Qth-registry formatted listing of the
         contents of this level of the directory tree, including entries
-        describing available subdirectories.
+        describing available subdirectories. If the tree was constructed with
+        summaries=True, subdirectory entries include an additional "summary"
+        entry (see :py:meth:`get_summary`).
         """
         return {
             topic: [description if not isinstance(description, Tree) else
-                    {"behaviour": qth.DIRECTORY,
-                     "description": "A subdirectory.",
-                     "client_id": None}
+                    description._get_directory_entry()
                     for description in descriptions]
             for topic, descriptions in self.children.items()
         }
 
+    def _get_directory_entry(self):
+        """Internal. Get the listing entry describing this tree as a
+        subdirectory.
+        """
+        entry = {"behaviour": qth.DIRECTORY,
+                 "description": "A subdirectory.",
+                 "client_id": None}
+        if self.summaries:
+            entry["summary"] = self.get_summary()
+        return entry
+
     def iter_listings(self, topic="meta/ls/"):
         """An iterator over the Qth-style directory listings for the entire
         directory structure.
@@ -78,13 +137,36 @@ class Tree(object):
                     yield from child.iter_listings(child_topic)
 
 
-def client_registrations_to_directory_tree(client_registrations):
+def client_registrations_to_directory_tree(client_registrations,
+                                           summaries=False):
     """Given a dictionary mapping client IDs to registration dicts, returns a
     dict mapping from directory listing path to directory listing entry.
+
+    If summaries is True, subdirectory entries include a summary of their
+    contents (see :py:meth:`Tree.get_summary`).
     """
-    tree = Tree()
+    steps = client_registrations_to_directory_tree_steps(
+        client_registrations, summaries)
+    while True:
+        try:
+            next(steps)
+        except StopIteration as e:
+            return e.value
 
-    for client_id, client_registration in client_registrations.items():
+
+def client_registrations_to_directory_tree_steps(client_registrations,
+                                                 summaries=False):
+    """A generator version of :py:func:`client_registrations_to_directory_tree`
+    which yields (None) after each small unit of work, allowing the work to be
+    interleaved with other tasks. The resulting dict is returned by the
+    generator (i.e. as the value of the final StopIteration).
+
+    The client_registrations dict may be modified between steps; only those
+    registrations present when the generator starts are included.
+    """
+    tree = Tree(summaries)
+
+    for client_id, client_registration in list(client_registrations.items()):
         try:
             # Add topics registered by the client
             for topic, description in client_registration["topics"].items():
@@ -101,5 +183,19 @@ def client_registrations_to_directory_tree(client_registrations):
             logging.error("Malformed registration for client '%s': %s",
                           client_id, client_registration)
             logging.exception(e)
+        yield
+
+    listings = {}
+    for topic, listing in tree.iter_listings():
+        listings[topic] = listing
+        yield
+
+    return listings
 
-    return dict(tree.iter_listings())
+
+def listing_digest(listing):
+    """Return a compact digest of a directory listing. Two listings have the
+    same digest iff they are equal (barring hash collisions).
+    """
+    return hashlib.sha1(json.dumps(listing, sort_keys=True,
+                                   separators=(",", ":")).encode()).digest()
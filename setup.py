@@ -36,6 +36,7 @@ setup(
     entry_points={
         "console_scripts": [
             "qth_registrar = qth_registrar.server:main",
+            "qth_registrar_replay = qth_registrar.replay:main",
         ],
     }
 )
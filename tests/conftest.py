@@ -0,0 +1,33 @@
+import pytest
+
+import asyncio
+
+import qth_registrar
+from qth_registrar.replay import StubClient
+
+
+@pytest.fixture
+async def make_stub_reg():
+    """A factory for registrars connected to a StubClient (rather than a real
+    MQTT server). Takes the same arguments as QthRegistrar (with client
+    defaulting to a new StubClient) and returns once the registrar has
+    started up.
+    """
+    regs = []
+
+    async def make_stub_reg(**kwargs):
+        kwargs.setdefault("load_time", 0.0)
+        kwargs.setdefault("client", StubClient({}))
+        r = qth_registrar.QthRegistrar(**kwargs)
+        regs.append(r)
+
+        # Wait for startup to complete
+        while not r._enable_listings_updates:
+            await asyncio.sleep(0.01)
+        return r
+
+    try:
+        yield make_stub_reg
+    finally:
+        for r in regs:
+            await r.close()
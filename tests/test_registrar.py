@@ -5,8 +5,13 @@ import subprocess
 
 import asyncio
 
+import time
+
 import qth
 import qth_registrar
+from qth_registrar.replay import StubClient
+from qth_registrar.recording import iter_recording, SESSION
+from qth_registrar.tree import client_registrations_to_directory_tree_steps
 
 
 @pytest.fixture(scope="module")
@@ -222,3 +227,181 @@ async def test_unregister_actions(reg, client, hostname, port):
 
     finally:
         await dut.close()
+
+
+@pytest.mark.asyncio
+async def test_publisher_pool(server, hostname, port, client):
+    reg = qth_registrar.QthRegistrar(load_time=0.1, num_publishers=2,
+                                     host=hostname, port=port)
+    try:
+        on_ls_event = asyncio.Event()
+        on_ls = Mock(side_effect=lambda *_: on_ls_event.set())
+        await client.watch_property("meta/ls/pool/", on_ls)
+
+        await client.register("pool/test", qth.EVENT_ONE_TO_MANY,
+                              "A test event.")
+        await asyncio.wait_for(on_ls_event.wait(), 5.0)
+        on_ls.assert_called_with("meta/ls/pool/", {
+            "test": [{"behaviour": "EVENT-1:N",
+                      "description": "A test event.",
+                      "client_id": "test-client"}],
+        })
+    finally:
+        await reg.close()
+
+
+@pytest.fixture
+async def stub_reg(make_stub_reg):
+    return await make_stub_reg(reconcile_slice=0.001,
+                               stall_check_interval=0.01)
+
+
+@pytest.mark.asyncio
+async def test_reconcile_slicing(stub_reg):
+    stub_reg._client_registrations.update({
+        "c{}".format(c): {"topics": {
+            "dev{}/t{}/value".format(c, t): {
+                "behaviour": qth.EVENT_ONE_TO_MANY,
+                "description": "An example."}
+            for t in range(10)}}
+        for c in range(1000)
+    })
+
+    # Count how often another task gets to run
+    ticks = 0
+
+    async def ticker():
+        nonlocal ticks
+        while True:
+            ticks += 1
+            await asyncio.sleep(0)
+
+    ticker_task = asyncio.create_task(ticker())
+    await asyncio.sleep(0)
+    try:
+        # The tree build and diff should each yield to the loop several times
+        before = ticks
+        new_tree = await stub_reg._run_sliced(
+            client_registrations_to_directory_tree_steps(
+                stub_reg._client_registrations))
+        assert ticks > before + 1
+
+        before = ticks
+        await stub_reg._run_sliced(stub_reg._diff_steps(new_tree))
+        assert ticks > before + 1
+
+        # Without a slice budget, the work should never yield
+        stub_reg._reconcile_slice = None
+        before = ticks
+        new_tree = await stub_reg._run_sliced(
+            client_registrations_to_directory_tree_steps(
+                stub_reg._client_registrations))
+        await stub_reg._run_sliced(stub_reg._diff_steps(new_tree))
+        assert ticks == before
+    finally:
+        ticker_task.cancel()
+
+
+@pytest.mark.asyncio
+async def test_max_loop_stall(stub_reg):
+    await asyncio.sleep(0.05)
+    assert stub_reg.max_loop_stall < 0.1
+
+    # Deliberately block the event loop
+    time.sleep(0.2)
+    await asyncio.sleep(0.05)
+    assert stub_reg.max_loop_stall >= 0.15
+
+
+class RecordingStubClient(StubClient):
+    """A StubClient which records the topics it publishes to and the latest
+    payload published to each.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.published_topics = []
+        self.published_payloads = {}
+
+    async def publish(self, topic, payload, retain=False):
+        self.published_topics.append(topic)
+        self.published_payloads[topic] = payload
+        await super().publish(topic, payload, retain)
+
+
+@pytest.mark.asyncio
+async def test_directory_summaries(make_stub_reg):
+    client = RecordingStubClient({})
+    await make_stub_reg(client=client, directory_summaries=True)
+
+    await client.deliver("client", "meta/clients/c1", {
+        "topics": {"foo/bar": {"behaviour": qth.EVENT_ONE_TO_MANY,
+                               "description": "Bar."}},
+    })
+    await asyncio.sleep(0.05)
+
+    assert client.published_payloads["meta/ls/"]["foo"] == [{
+        "behaviour": "DIRECTORY",
+        "description": "A subdirectory.",
+        "client_id": None,
+        "summary": {"num_topics": 1,
+                    "behaviours": {"EVENT-1:N": 1},
+                    "num_clients": 1},
+    }]
+
+
+@pytest.mark.asyncio
+async def test_publisher_pool_distribution(make_stub_reg):
+    client = RecordingStubClient({})
+    publishers = [RecordingStubClient({}) for _ in range(3)]
+    await make_stub_reg(client=client, publishers=publishers)
+
+    async def register_all(description):
+        for c in range(50):
+            await client.deliver("client", "meta/clients/c{}".format(c), {
+                "topics": {"dev{}/value".format(c): {
+                    "behaviour": qth.PROPERTY_ONE_TO_MANY,
+                    "description": description,
+                }},
+            })
+        await asyncio.sleep(0.1)
+
+    await register_all("First.")
+    connections = [client] + publishers
+
+    # Publications should be spread across every connection
+    for connection in connections:
+        assert connection.published_topics
+
+    # A given topic should always be published using the same connection,
+    # including on subsequent reconciliations
+    await register_all("Second.")
+    topic_connections = {}
+    for i, connection in enumerate(connections):
+        for topic in connection.published_topics:
+            assert topic_connections.setdefault(topic, i) == i
+    assert "meta/ls/dev0/" in topic_connections
+
+
+@pytest.mark.asyncio
+async def test_publisher_pool_ignored(tmpdir, make_stub_reg):
+    filename = str(tmpdir.join("recording"))
+    client = StubClient({})
+    publisher = StubClient({}, client_id="pool-publisher")
+    reg = await make_stub_reg(client=client, publishers=[publisher],
+                              record_filename=filename)
+    reg._reconcile = Mock(side_effect=reg._reconcile)
+
+    # Messages from the pool's connections (e.g. on closing) should neither
+    # trigger a reconciliation nor be recorded...
+    await client.deliver("client", "meta/clients/pool-publisher", qth.Empty)
+    await asyncio.sleep(0.05)
+    assert reg._reconcile.mock_calls == []
+    assert [kind for _, kind, _, _ in iter_recording(filename)] == [SESSION]
+
+    # ...though other clients' messages should
+    await client.deliver("client", "meta/clients/other", qth.Empty)
+    await asyncio.sleep(0.05)
+    assert len(reg._reconcile.mock_calls) == 1
+    assert [topic for _, _, topic, _ in iter_recording(filename)] == [
+        None, "meta/clients/other"]
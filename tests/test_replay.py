@@ -0,0 +1,161 @@
+import pytest
+
+import json
+
+import asyncio
+
+import qth
+
+from qth_registrar.recording import Recorder, iter_recording, read_sessions, \
+    CLIENT, LISTING, SESSION
+from qth_registrar.replay import replay
+
+
+@pytest.fixture
+def recording(tmpdir):
+    # A stale listing read back on startup, followed (well after the default
+    # 3 second load time) by a client connecting and then disconnecting.
+    filename = str(tmpdir.join("recording"))
+    r = Recorder(filename, timestamp=1000.0)
+    r.record(LISTING, "meta/ls/", {"old": [{"behaviour": "EVENT-1:N",
+                                            "description": "Stale.",
+                                            "client_id": "c0"}]},
+             timestamp=1000.0)
+    r.record(CLIENT, "meta/clients/c1", {
+        "description": "Client one.",
+        "topics": {"foo/bar": {"behaviour": "EVENT-1:N",
+                               "description": "An event."}},
+    }, timestamp=1005.0)
+    r.record(CLIENT, "meta/clients/c1", qth.Empty, timestamp=1010.0)
+    r.close()
+    return filename
+
+
+def test_iter_recording(recording):
+    records = list(iter_recording(recording))
+    assert [(kind, topic) for _, kind, topic, _ in records] == [
+        (SESSION, None),
+        (LISTING, "meta/ls/"),
+        (CLIENT, "meta/clients/c1"),
+        (CLIENT, "meta/clients/c1"),
+    ]
+    assert records[2][3]["description"] == "Client one."
+    assert records[3][3] is qth.Empty
+    assert [timestamp for timestamp, _, _, _ in records] == [
+        1000.0, 1000.0, 1005.0, 1010.0]
+
+
+def test_recorder_timestamps(tmpdir):
+    filename = str(tmpdir.join("recording"))
+    r = Recorder(filename)
+    r.record(CLIENT, "meta/clients/c1", qth.Empty)
+    r.record(CLIENT, "meta/clients/c1", qth.Empty)
+    r.close()
+
+    # Timestamps (including the session's) default to now and should be
+    # non-decreasing
+    timestamps = [timestamp for timestamp, _, _, _ in iter_recording(filename)]
+    assert timestamps == sorted(timestamps)
+    assert timestamps[0] > 0
+
+
+def test_read_sessions(recording):
+    # A later registrar run appending to the same recording (a long time
+    # later)
+    r = Recorder(recording, timestamp=100000.0)
+    r.record(CLIENT, "meta/clients/c2", qth.Empty, timestamp=100001.0)
+    r.close()
+
+    sessions = read_sessions(recording)
+    assert [start for start, _ in sessions] == [1000.0, 100000.0]
+    assert [len(records) for _, records in sessions] == [3, 1]
+    assert sessions[1][1] == [(100001.0, CLIENT, "meta/clients/c2",
+                               qth.Empty)]
+
+
+def test_read_sessions_without_marker(tmpdir):
+    filename = str(tmpdir.join("recording"))
+    with open(filename, "w") as f:
+        f.write('[10.0,"client","meta/clients/c1"]\n')
+    assert read_sessions(filename) == [
+        (10.0, [(10.0, CLIENT, "meta/clients/c1", qth.Empty)]),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_replay_sessions(recording):
+    r = Recorder(recording, timestamp=100000.0)
+    r.record(CLIENT, "meta/clients/c2", qth.Empty, timestamp=100005.0)
+    r.close()
+
+    # Only the chosen session should be replayed (and the gap between
+    # sessions never slept through)
+    report = await asyncio.wait_for(replay(recording, speed=50.0), 5.0)
+    assert report["num_sessions"] == 2
+    assert report["num_messages"] == 2
+    assert report["num_reconciles"] == 3
+
+    report = await asyncio.wait_for(
+        replay(recording, speed=50.0, session=1), 5.0)
+    assert report["num_messages"] == 1
+    assert report["num_reconciles"] == 2
+
+    with pytest.raises(ValueError):
+        await replay(recording, session=2)
+
+
+@pytest.mark.asyncio
+async def test_replay(recording):
+    report = await replay(recording, speed=50.0)
+    assert report["num_sessions"] == 1
+    assert report["num_messages"] == 2
+
+    # One reconciliation on startup and one per client message
+    assert report["num_reconciles"] == 3
+    assert len(report["reconcile_latencies"]) == 3
+
+    # On startup: the stale root listing is replaced. On connection: the root
+    # listing plus 'foo', 'meta' and 'meta/clients' are published. On
+    # disconnection: the root listing is replaced and the other three are
+    # deleted.
+    assert report["num_publishes"] == 1 + 4 + 4
+
+    # Deletions are sent as empty messages
+    directory = {"behaviour": "DIRECTORY",
+                 "description": "A subdirectory.",
+                 "client_id": None}
+    connected_listings = [
+        {"foo": [directory], "meta": [directory]},
+        {"bar": [{"behaviour": "EVENT-1:N",
+                  "description": "An event.",
+                  "client_id": "c1"}]},
+        {"clients": [directory]},
+        {"c1": [{"behaviour": "PROPERTY-1:N",
+                 "description": "Client Qth registration details.",
+                 "client_id": "c1"}]},
+    ]
+    assert report["publish_bytes"] == (
+        len(json.dumps({})) +
+        sum(len(json.dumps(listing)) for listing in connected_listings) +
+        len(json.dumps({})))
+
+
+@pytest.mark.asyncio
+async def test_replay_digest_tree(recording):
+    # Digest-only storage should not change what is published
+    report = await replay(recording, speed=50.0)
+    digest_report = await replay(recording, speed=50.0, digest_tree=True)
+    assert digest_report["num_reconciles"] == 3
+    assert digest_report["num_publishes"] == report["num_publishes"]
+    assert digest_report["publish_bytes"] == report["publish_bytes"]
+
+
+@pytest.mark.asyncio
+async def test_replay_reconcile_slice(recording):
+    # Yielding to the event loop during reconciliation (here, after every
+    # step) should not change what is published
+    report = await replay(recording, speed=50.0, reconcile_slice=None)
+    sliced_report = await replay(recording, speed=50.0, reconcile_slice=0.0)
+    assert sliced_report["num_reconciles"] == 3
+    assert sliced_report["num_publishes"] == report["num_publishes"]
+    assert sliced_report["publish_bytes"] == report["publish_bytes"]
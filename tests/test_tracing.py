@@ -0,0 +1,39 @@
+import pytest
+
+import json
+
+import asyncio
+
+import qth
+
+from qth_registrar.replay import StubClient
+
+
+@pytest.mark.asyncio
+async def test_tracing(tmpdir, make_stub_reg):
+    filename = str(tmpdir.join("trace"))
+    client = StubClient({})
+    await make_stub_reg(client=client, trace_filename=filename)
+
+    await client.deliver("client", "meta/clients/c1", {
+        "description": "Client one.",
+        "topics": {"foo": {"behaviour": qth.EVENT_ONE_TO_MANY,
+                           "description": "Foo."}},
+    })
+    await asyncio.sleep(0.1)
+    await client.deliver("client", "meta/clients/c1", qth.Empty)
+    await asyncio.sleep(0.1)
+
+    with open(filename) as f:
+        records = [json.loads(line) for line in f]
+
+    # One record per registration message
+    assert [r["client_id"] for r in records] == ["c1", "c1"]
+    assert records[0]["reconcile"] < records[1]["reconcile"]
+    for record in records:
+        assert record["num_published"] > 0
+        for phase in ("queued", "build", "diff", "publish"):
+            assert 0.0 <= record[phase] <= record["latency"]
+        assert record["latency"] == pytest.approx(
+            record["queued"] + record["build"] +
+            record["diff"] + record["publish"])
@@ -1,4 +1,5 @@
-from qth_registrar.tree import Tree, client_registrations_to_directory_tree
+from qth_registrar.tree import Tree, client_registrations_to_directory_tree, \
+    client_registrations_to_directory_tree_steps, listing_digest
 
 
 class TestTree(object):
@@ -106,6 +107,54 @@ class TestTree(object):
             ("meta/ls/jam/", {"lub": [{"very": "lots"}]}),
         ]
 
+    def test_summaries(self):
+        t = Tree(summaries=True)
+
+        # Empty
+        assert t.get_summary() == {"num_topics": 0, "behaviours": {},
+                                   "num_clients": 0}
+
+        t.add_topic("foo/bar", {"behaviour": "EVENT-1:N", "client_id": "c1"})
+        t.add_topic("foo/baz", {"behaviour": "EVENT-1:N", "client_id": "c2"})
+        t.add_topic("foo/qux/quo", {"behaviour": "PROPERTY-1:N",
+                                    "client_id": "c1"})
+        t.add_topic("jam", {"behaviour": "PROPERTY-N:1", "client_id": "c3"})
+
+        assert t.get_summary() == {
+            "num_topics": 4,
+            "behaviours": {"EVENT-1:N": 2, "PROPERTY-1:N": 1,
+                           "PROPERTY-N:1": 1},
+            "num_clients": 3,
+        }
+
+        assert t.get_listing()["foo"] == [{
+            "behaviour": "DIRECTORY",
+            "description": "A subdirectory.",
+            "client_id": None,
+            "summary": {
+                "num_topics": 3,
+                "behaviours": {"EVENT-1:N": 2, "PROPERTY-1:N": 1},
+                "num_clients": 2,
+            },
+        }]
+
+        # Nested directories are summarised too
+        listings = dict(t.iter_listings())
+        assert listings["meta/ls/foo/"]["qux"][0]["summary"] == {
+            "num_topics": 1,
+            "behaviours": {"PROPERTY-1:N": 1},
+            "num_clients": 1,
+        }
+
+    def test_no_summaries(self):
+        t = Tree()
+        t.add_topic("foo/bar", {"behaviour": "EVENT-1:N", "client_id": "c1"})
+
+        # Summaries only appear when requested
+        assert t.get_listing()["foo"] == [{"behaviour": "DIRECTORY",
+                                           "description": "A subdirectory.",
+                                           "client_id": None}]
+
 
 def test_client_registrations_to_directory_tree():
     client_registrations = {
@@ -166,3 +215,78 @@ def test_client_registrations_to_directory_tree():
                     "client_id": "c2"}],
         },
     }
+
+
+def test_client_registrations_to_directory_tree_summaries():
+    client_registrations = {
+        "c1": {"topics": {"example/foo": {"behaviour": "EVENT-1:N",
+                                          "description": "Foo."}}},
+        "c2": {"topics": {"example/bar": {"behaviour": "PROPERTY-1:N",
+                                          "description": "Bar."}}},
+    }
+
+    tree = client_registrations_to_directory_tree(client_registrations,
+                                                  summaries=True)
+    assert tree["meta/ls/"]["example"][0]["summary"] == {
+        "num_topics": 2,
+        "behaviours": {"EVENT-1:N": 1, "PROPERTY-1:N": 1},
+        "num_clients": 2,
+    }
+
+    # The client registration properties are included in the summaries too
+    assert tree["meta/ls/"]["meta"][0]["summary"] == {
+        "num_topics": 2,
+        "behaviours": {"PROPERTY-1:N": 2},
+        "num_clients": 2,
+    }
+
+    # Not included by default
+    tree = client_registrations_to_directory_tree(client_registrations)
+    assert "summary" not in tree["meta/ls/"]["meta"][0]
+
+
+def test_client_registrations_to_directory_tree_steps():
+    client_registrations = {
+        "c1": {"topics": {"foo/bar": {"behaviour": "EVENT-1:N",
+                                      "description": "Bar."}}},
+        "c2": {"topics": {"baz": {"behaviour": "EVENT-1:N",
+                                  "description": "Baz."}}},
+    }
+    expected = client_registrations_to_directory_tree(client_registrations)
+
+    steps = client_registrations_to_directory_tree_steps(client_registrations)
+    num_steps = 0
+    next(steps)
+
+    # Changes made mid-way should not break the build
+    client_registrations["c3"] = {"topics": {}}
+    del client_registrations["c1"]
+
+    try:
+        while True:
+            next(steps)
+            num_steps += 1
+    except StopIteration as e:
+        assert e.value == expected
+
+    # Work should have been broken into multiple steps
+    assert num_steps > 1
+
+
+def test_listing_digest():
+    listing = {
+        "foo": [{"behaviour": "EVENT-1:N", "description": "Foo.",
+                 "client_id": "c1"}],
+        "bar": [{"behaviour": "DIRECTORY", "description": "A subdirectory.",
+                 "client_id": None}],
+    }
+
+    # Insensitive to dictionary ordering
+    reordered = {"bar": listing["bar"], "foo": [
+        {"client_id": "c1", "description": "Foo.", "behaviour": "EVENT-1:N"},
+    ]}
+    assert listing_digest(listing) == listing_digest(reordered)
+
+    # Sensitive to changes
+    changed = {"foo": listing["foo"]}
+    assert listing_digest(listing) != listing_digest(changed)